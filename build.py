@@ -0,0 +1,128 @@
+#!/usr/bin/env python3.10
+
+from interpreter import *
+from functools import lru_cache
+import hashlib
+import json
+import os
+import sys
+
+# Incremental builds: every output is recorded in a manifest together with the hashes
+# of everything that went into it, so unchanged outputs can be skipped without lexing,
+# parsing or interpreting anything.
+
+MANIFEST_NAME = ".lamb_build.json"
+
+USAGE = "Usage: build [input filepath:output filepath]... [-l library filepath]..."
+
+# Modules whose source decides what an output looks like, hashed together as the interpreter version
+INTERPRETER_MODULES = ("lexer.py", "parser.py", "sexpr.py", "interpreter.py")
+
+def file_hash(path):
+	with open(path, "rb") as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+# Hash of the sources of modules (a tuple of file names next to this one), computed once per process
+@lru_cache
+def sources_hash(modules):
+	digest = hashlib.sha256()
+	base = os.path.dirname(os.path.abspath(__file__))
+	for module in modules:
+		digest.update(file_hash(os.path.join(base, module)).encode())
+	return digest.hexdigest()
+
+def interpreter_version():
+	return sources_hash(INTERPRETER_MODULES)
+
+def load_manifest(manifest_path):
+	try:
+		with open(manifest_path, "r") as f:
+			return json.load(f)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return {}
+
+def save_manifest(manifest_path, manifest):
+	# Write then rename so an interrupted build never leaves half a manifest behind
+	temp_path = manifest_path + ".tmp"
+	with open(temp_path, "w") as f:
+		json.dump(manifest, f, indent = 1, sort_keys = True)
+	os.replace(temp_path, manifest_path)
+
+# Paths in the manifest are stored relative to the directory holding it, so ./b.out,
+# b.out and an absolute path to it all end up as the same record
+def manifest_path_key(path, manifest_dir):
+	return os.path.relpath(path, manifest_dir)
+
+# Drops records that can no longer be trusted: ones under a key that is not in normal form,
+# as left behind by older manifests, and ones whose output has since been deleted
+def prune_manifest(manifest, manifest_dir):
+	stale = [key for key in manifest
+	         if key != os.path.normpath(key) or os.path.isabs(key)
+	         or not os.path.exists(os.path.join(manifest_dir, key))]
+	for key in stale:
+		del manifest[key]
+	return len(stale) > 0
+
+# Returns the record describing how an output of file would be built right now
+def build_record(file, libraries, manifest_dir):
+	return {
+		"inputs": [[manifest_path_key(path, manifest_dir), file_hash(path)] for path in [*libraries, file]],
+		"interpreter": interpreter_version(),
+	}
+
+def up_to_date(previous, output_filepath, record):
+	if (previous == None or not os.path.exists(output_filepath)):
+		return False
+
+	return (previous["inputs"] == record["inputs"] and previous["interpreter"] == record["interpreter"]
+	        and previous["output"] == file_hash(output_filepath))
+
+# Builds every (input filepath, output filepath) pair in targets, skipping outputs whose
+# inputs, libraries and interpreter have not changed since the last build.
+# Returns the list of outputs that were regenerated.
+def build(targets, libraries = (), manifest_path = MANIFEST_NAME, budget = None):
+	manifest = load_manifest(manifest_path)
+	manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+	pruned = prune_manifest(manifest, manifest_dir)
+	rebuilt = []
+
+	try:
+		for file, output_filepath in targets:
+			key = manifest_path_key(output_filepath, manifest_dir)
+			record = build_record(file, libraries, manifest_dir)
+			if (up_to_date(manifest.get(key), output_filepath, record)):
+				continue
+
+			# Forget the old record first, a failed build must not look up to date next time
+			manifest.pop(key, None)
+			interp(file, output_filepath, budget, libraries)
+
+			record["output"] = file_hash(output_filepath)
+			manifest[key] = record
+			rebuilt.append(output_filepath)
+	finally:
+		if (rebuilt or pruned or not os.path.exists(manifest_path)):
+			save_manifest(manifest_path, manifest)
+
+	return rebuilt
+
+if (__name__ == "__main__"):
+	if len(sys.argv) < 2:
+		print(USAGE)
+		sys.exit(0)
+
+	targets, libraries = [], []
+	args = iter(sys.argv[1:])
+	for arg in args:
+		if (arg == "-l"):
+			libraries.append(next(args))
+		else:
+			file, colon, output_filepath = arg.partition(":")
+			if (not colon or not file or not output_filepath):
+				print(f"Expected input filepath:output filepath, got {arg!r}")
+				print(USAGE)
+				sys.exit(1)
+			targets.append((file, output_filepath))
+
+	rebuilt = build(targets, libraries)
+	print(f"Rebuilt {len(rebuilt)} of {len(targets)} outputs.")
@@ -8,49 +8,74 @@ from dataclasses import dataclass
 from copy import deepcopy
 import sys
 from io import StringIO
+from time import perf_counter
 
 # Generic exception used for any sort of interpretation errors we might encounter
 class InterpException(Exception): pass
 
+# Raised when an expansion runs over one of the limits set in its Budget,
+# records which limit was hit and where so runaway templates can be tracked down
+class BudgetException(InterpException):
+	def __init__(self, resource, limit, macro, line):
+		self.resource = resource
+		self.limit = limit
+		self.macro = macro
+		self.line = line
+
+		location = f"macro {macro}" if macro != None else "top level"
+		if (line != None): location += f", line {line.strip()!r}"
+		super().__init__(f"Exceeded {resource} budget of {limit} in {location}")
+
+# Limits for a single expansion, None means unlimited
+@dataclass(eq = False)
+class Budget:
+	max_steps: int = None   # Evaluated statements, loop iterations and macro calls
+	max_time: float = None  # Wall clock seconds
+	max_output: int = None  # Bytes written to the output file or buffered for it
+	max_memory: int = None  # Approximate bytes held by any single string or list value
+
 # Represents a value produced from interpreting an SExpr
+# Like SExprs they are matched on rather than compared, so skip generating __eq__
 class Value: pass
 
 class Environment: pass
 
-@dataclass
+@dataclass(eq = False)
 class Environment:
 	binds: dict[str, Value]
 	parent: Environment
 
-@dataclass
+@dataclass(eq = False)
 class VNum(Value):
 	val: int
 	def __str__(self):
 		return str(int(self.val))
 
-@dataclass
+@dataclass(eq = False)
 class VNone(Value):
 	def __str__(self):
 		return "none"
 
 
-@dataclass
+@dataclass(eq = False)
 class VStr(Value):
 	val: str
 	def __str__(self):
 		return self.val
 
-@dataclass
+@dataclass(eq = False)
 class VList(Value):
 	vals: list[Value]
 	def __str__(self):
 		return ", ".join([str(val) for val in self.vals])
 
-@dataclass
+@dataclass(eq = False)
 class VClos(Value):
 	params: list[Fparam]
 	body: SExpr
 	env: Environment
+	name: str = None
+	node: SMacro = None  # Definition whose body is still to be parsed, see parse_macro_body
 
 def search_environment(env, ident):
 	while (env != None):
@@ -76,9 +101,95 @@ def set_variable(env, ident, val, localized = False, index = -1):
 	env.binds[ident] = val
 	return val
 
+# Budget state for the current expansion, reset by interp
+__budget = None
+__steps = 0
+__deadline = None
+__output_size = 0
+__buffered_size = 0  # Bytes of the lines held in __native_strings
+
+# Macros currently being called and the native line being expanded, only used for error reporting
+__macro_stack = []
+__current_line = None
+
+# Reading the clock is much slower than counting, so time is only checked every so many steps
+TIME_CHECK_INTERVAL = 64
+
+def __exceeded(resource, limit):
+	macro = __macro_stack[-1] if __macro_stack else None
+	return BudgetException(resource, limit, macro, __current_line)
+
+def __reset_budget(budget):
+	global __budget, __steps, __deadline, __output_size, __buffered_size, __current_line
+	__budget = budget
+	__steps = 0
+	__output_size = 0
+	__buffered_size = 0
+	__deadline = None
+	if (budget != None and budget.max_time != None):
+		__deadline = perf_counter() + budget.max_time
+
+	__macro_stack.clear()
+	__native_strings.clear()
+	__current_line = None
+
+def __charge_step():
+	global __steps
+	if (__budget == None): return
+
+	__steps += 1
+	if (__budget.max_steps != None and __steps > __budget.max_steps):
+		raise __exceeded("step", __budget.max_steps)
+
+	if (__deadline != None and __steps % TIME_CHECK_INTERVAL == 0 and perf_counter() > __deadline):
+		raise __exceeded("time", __budget.max_time)
+
+def __charge_output(text):
+	global __output_size
+	if (__budget == None or __budget.max_output == None): return
+
+	__output_size += len(text.encode())
+	if (__output_size > __budget.max_output):
+		raise __exceeded("output", __budget.max_output)
+
+# Lines produced inside macro calls are buffered until they reach the top level,
+# they count towards the output (and memory) budget as soon as they are buffered
+def __charge_buffered(line):
+	global __buffered_size
+	if (__budget == None): return
+
+	__buffered_size += len(line.encode())
+	if (__budget.max_output != None and __output_size + __buffered_size > __budget.max_output):
+		raise __exceeded("output", __budget.max_output)
+	__charge_size(__buffered_size)
+
+# Buffered lines joined back into a line are charged again with that line
+def __release_buffered(lines):
+	global __buffered_size
+	if (__budget == None): return
+
+	__buffered_size -= sum([len(line.encode()) for line in lines])
+
+# Only the container itself is measured, elements are charged when they are built
+def __charge_memory(value):
+	if (__budget == None or __budget.max_memory == None): return value
+
+	match value:
+		case VStr(val): __charge_size(sys.getsizeof(val))
+		case VList(vals): __charge_size(sys.getsizeof(vals))
+	return value
+
+# Lets bulk operations check what they are about to allocate before doing so
+def __charge_size(size):
+	if (__budget == None or __budget.max_memory == None): return
+
+	if (size > __budget.max_memory):
+		raise __exceeded("memory", __budget.max_memory)
+
 def __interp_block(exprs, env):
 	last = VNone()
 	for expr in exprs:
+		__charge_step()
 		last = __interp(expr, env)
 	return last
 
@@ -90,6 +201,14 @@ __native_strings = []
 # Call syntax = ($var_name) || ($macro_name(arg1, arg2...))
 
 def parse_native_line_call(line):
+	call = find_native_line_call(line)
+	if (call == None): return None
+
+	beg, end = call
+	return (beg, end, parse_native_expression(line[beg + 2: end]))
+
+# Returns (call_beginning, call_ending) of the last call in the line, None if there are none
+def find_native_line_call(line):
 	# We search in reverse to evaluate macros back to front
 	beg = len(line) - line[::-1].find(MACRO_CHAR) - 1
 	if (beg == len(line)): return None # We did not find any special character
@@ -102,9 +221,15 @@ def parse_native_line_call(line):
 		if (line[end] == '('): paren_depth += 1
 		elif (line[end] == ')'): paren_depth -= 1
 
-	expression = parse_expression(new_lex(StringIO(line[beg + 2: end]), in_macro = True), -1)
+	return (beg, end)
 
-	return (beg, end, expression)
+# Sets the parameters of macro to args in its environment, before its body is run
+def bind_arguments(macro, args):
+	for idx, param in enumerate(macro.params):
+		if (param.vari):
+			set_variable(macro.env, param.name, VList(args[idx:]))
+		else:
+			set_variable(macro.env, param.name, args[idx])
 
 def iterable_to_iterator(iterable):
 	match iterable:
@@ -117,8 +242,135 @@ def mutate_iterable_index(iterable, idx, new_value):
 			vals[idx] = new_value
 	return new_value
 
+# Built-in functions, used when no macro or variable of the same name is bound, so
+# resolving them costs nothing for ordinary macro calls. Each one is called with the
+# function to use for calling macros (call(macro, args)), followed by the evaluated
+# arguments, and returns a Value. More can be added with register_builtin.
+BUILTINS = {}
+
+def register_builtin(name, func):
+	BUILTINS[name] = func
+
+def __bad_arguments(name):
+	return InterpException(f"Bad arguments to {name}")
+
+def __is_iterable(value):
+	return type(value) in (VStr, VList)
+
+def __builtin_len(call, *args):
+	if (len(args) != 1): raise InterpException("len only takes 1 argument")
+	if (not __is_iterable(args[0])): raise __bad_arguments("len")
+
+	return VNum(len(iterable_to_iterator(args[0])))
+
+def __builtin_debug(call, *args):
+	print(list(args))
+	return VNone()
+
+def __builtin_join(call, iterable, sep = VStr("")):
+	if (not __is_iterable(iterable) or type(sep) is not VStr): raise __bad_arguments("join")
+
+	return VStr(sep.val.join([str(val) for val in iterable_to_iterator(iterable)]))
+
+def __builtin_repeat(call, times, value):
+	if (type(times) is not VNum): raise __bad_arguments("repeat")
+
+	string = str(value)
+	times = max(int(times.val), 0)
+	__charge_size(len(string) * times)
+	return VStr(string * times)
+
+def __builtin_range(call, *bounds):
+	if (not all([type(bound) is VNum for bound in bounds])): raise __bad_arguments("range")
+
+	numbers = range(*[int(bound.val) for bound in bounds])
+	__charge_size(len(numbers) * sys.getsizeof(0))
+	return VList([VNum(number) for number in numbers])
+
+def __builtin_map(call, macro, iterable):
+	if (type(macro) is not VClos or not __is_iterable(iterable)): raise __bad_arguments("map")
+
+	return VList([call(macro, [val]) for val in iterable_to_iterator(iterable)])
+
+def __builtin_replace(call, value, old, new):
+	if (not all([type(arg) is VStr for arg in (value, old, new)])): raise __bad_arguments("replace")
+
+	return VStr(value.val.replace(old.val, new.val))
+
+def __builtin_split(call, value, sep = VNone()):
+	if (type(value) is not VStr or type(sep) not in (VStr, VNone)): raise __bad_arguments("split")
+
+	parts = value.val.split() if isinstance(sep, VNone) else value.val.split(sep.val)
+	return VList([VStr(part) for part in parts])
+
+def __builtin_slice(call, iterable, start, end = VNone()):
+	if (type(start) is not VNum or type(end) not in (VNum, VNone)): raise __bad_arguments("slice")
+
+	end = None if isinstance(end, VNone) else int(end.val)
+	match iterable:
+		case VStr(val): return VStr(val[int(start.val):end])
+		case VList(vals): return VList(vals[int(start.val):end])
+	raise __bad_arguments("slice")
+
+register_builtin("len", __builtin_len)
+register_builtin("debug", __builtin_debug)
+register_builtin("join", __builtin_join)
+register_builtin("repeat", __builtin_repeat)
+register_builtin("range", __builtin_range)
+register_builtin("map", __builtin_map)
+register_builtin("replace", __builtin_replace)
+register_builtin("split", __builtin_split)
+register_builtin("slice", __builtin_slice)
+
+# Carries an error raised by a macro that a built-in called, so it is not mistaken
+# for a problem with the built-in's own arguments
+class MacroCallError(Exception):
+	def __init__(self, error):
+		self.error = error
+
+# Runs built-in name on args, call_macro(macro, args) runs a macro in the calling backend
+def call_builtin(name, args, call_macro):
+	if (name not in BUILTINS): raise InterpException(f"Macro {name} not bound.")
+
+	def call(macro, macro_args):
+		try:
+			return call_macro(macro, macro_args)
+		except Exception as e:
+			raise MacroCallError(e)
+
+	try:
+		result = BUILTINS[name](call, *args)
+	except MacroCallError as e:
+		raise e.error
+	except (TypeError, AttributeError, ValueError) as e:
+		raise __bad_arguments(name) from e
+
+	# Registered built-ins that return something else would leak Python objects into the output
+	if (not isinstance(result, Value)): raise __bad_arguments(name)
+	return result
+
+def __call_builtin(name, args):
+	__charge_step()
+	call_macro = lambda macro, macro_args: __call_macro(macro.name, macro, macro_args)
+	return __charge_memory(call_builtin(name, args, call_macro))
+
+# Every call costs a step, including the ones built-ins such as map make,
+# charged once the macro is on the stack so running out names it
+def __call_macro(name, macro, args):
+	if (macro.body == None):
+		macro.body = parse_macro_body(macro.node)
+
+	bind_arguments(macro, args)
+
+	__macro_stack.append(name)
+	__charge_step()
+	result = __interp_block(macro.body, macro.env)
+	__macro_stack.pop()
+	return result
+
 # Super basic interpreter, no error checking
 def __interp(expr, env):
+	global __current_line
 	match expr:
 		case SNum(num): return VNum(num)
 		case SNone(): return VNone()
@@ -133,7 +385,7 @@ def __interp(expr, env):
 		case SOp("+", [a, b]): 
 			match (__interp(a, env), __interp(b, env)):
 				case (VNum(va), VNum(vb)): return VNum(va + vb)
-				case (VStr(va), VStr(vb)): return VStr(va + vb)
+				case (VStr(va), VStr(vb)): return __charge_memory(VStr(va + vb))
 
 		case SOp("-", [a, b]): return VNum(__interp(a, env).val - __interp(b, env).val)
 		case SOp("*", [a, b]): return VNum(__interp(a, env).val * __interp(b, env).val)
@@ -178,7 +430,7 @@ def __interp(expr, env):
 			return mutate_iterable_index(__interp(a, env), int(__interp(b, env).val), __interp(c, env))
 
 		case SList(elems):
-			return VList([__interp(elem, env) for elem in elems])
+			return __charge_memory(VList([__interp(elem, env) for elem in elems]))
 
 		case SIf(con, thn, els):
 			if (__interp(con, env).val):
@@ -189,36 +441,28 @@ def __interp(expr, env):
 			last = VNone()
 			loop_env = Environment({}, env)
 			while (__interp(cond, loop_env).val > 0):
+				__charge_step()
 				last = __interp_block(body, loop_env)
 			return last
 
 		case SMacro(name, params, body):
-			closure = VClos(params, body, Environment({}, env))
+			closure = VClos(params, body, Environment({}, env), name, expr)
 			return set_variable(env, name, closure)
 
-		case SApp(SIdent("len"), args):
-			if (len(args) != 1): raise InterpException("len only takes 1 argument")
-
-			return VNum(len(iterable_to_iterator(__interp(args[0], env))))
-
-		case SApp(SIdent("debug"), args):
-			print([__interp(arg, env) for arg in args])
-			return VNone()
-
 		case SApp(func, args):
 			macro = search_environment(env, func.ident)
 			args = [__interp(arg, env) for arg in args]
-			for idx, param in enumerate(macro.params):
-				if (param.vari):
-					set_variable(macro.env, param.name, VList(args[idx:]))
-				else:
-					set_variable(macro.env, param.name, args[idx])
-			return __interp_block(macro.body, macro.env)
+			if (macro == None):
+				return __call_builtin(func.ident, args)
+			return __call_macro(func.ident, macro, args)
 
 		# This is probably the trickiest part of the whole thing :/
 		# Plan: buffer line somehwere until fully processed
 		# Try to parse args as native objects otherwise bail
 		case SNative(line):
+			outer_line = __current_line
+			__current_line = line
+
 			native_line_idx = len(__native_strings)
 			__native_strings.append("")
 
@@ -251,31 +495,85 @@ def __interp(expr, env):
 				# have more than one native string after the current one.
 				line = line[:beg] + to_output + "".join(__native_strings[native_line_idx + 1:]) + line[end + 1:]
 
+				__release_buffered(__native_strings[native_line_idx + 1:])
 				del __native_strings[native_line_idx + 1:]
 
 			# We must be outside of a macro, let's output this to the file
 			if (native_line_idx == 0): 
+				__charge_output(line)
 				__output_file.write(line)
 				del __native_strings[0]
 			else: 
+				__charge_buffered(line)
 				__native_strings[native_line_idx] = line
+
+			__current_line = outer_line
 			return
 
 	raise InterpException(f"Unknown expression: {expr}")
 
 __output_file = None
 
-def interp(file, output_filepath):
+# Runs already parsed statements in env, writing everything produced to output
+# (anything with a write method)
+def interp_statements(statements, env, output, budget = None):
 	global __output_file
+	__reset_budget(budget)
+	__output_file = output
+	try:
+		for statement in statements:
+			__interp(statement, env)
+	finally:
+		__output_file = None
+
+# Libraries only contribute definitions: they are run into the same environment
+# first, their output is discarded and they do not count towards the budget
+def interp(file, output_filepath, budget = None, libraries = (), lazy_macros = False):
+	global_env = Environment({}, None)
+	for library in libraries:
+		interp_statements(parse(lex_file(library), lazy_macros), global_env, StringIO())
+
+	statements = parse(lex_file(file), lazy_macros)
 	with open(output_filepath, "w") as f:
-		__output_file = f
-
-		global_env = Environment({}, None)
-		for statement in parse(lex_file(file)): 
-			__interp(statement, global_env)
+		interp_statements(statements, global_env, f, budget)
 
 	return True
 
+# Reusable entry point for expanding templates without going through files.
+# Macros defined by one expansion stay visible to the next when reuse_env is set,
+# which lets a shared library be loaded once and then used by many templates.
+# With lazy_macros, macro bodies are only parsed when they are first called.
+class Interpreter:
+	def __init__(self, budget = None, reuse_env = False, lazy_macros = False):
+		self.budget = budget
+		self.reuse_env = reuse_env
+		self.lazy_macros = lazy_macros
+		self.global_env = Environment({}, None)
+
+	# Forgets everything defined by previous expansions
+	def reset(self):
+		self.global_env = Environment({}, None)
+
+	def __environment(self):
+		if (not self.reuse_env): self.reset()
+		return self.global_env
+
+	# Expands text and returns the output as a string
+	def expand(self, text):
+		sink = StringIO()
+		self.expand_to(text, sink)
+		return sink.getvalue()
+
+	# Expands text, streaming output lines to sink as they are produced
+	def expand_to(self, text, sink):
+		interp_statements(parse(new_lex(StringIO(text)), self.lazy_macros), self.__environment(), sink, self.budget)
+		return sink
+
+	# Expands the file at file_path, streaming output lines to sink
+	def expand_file(self, file_path, sink):
+		interp_statements(parse(lex_file(file_path), self.lazy_macros), self.__environment(), sink, self.budget)
+		return sink
+
 # Small test for interpreting, very coolio
 if (__name__ == "__main__"):
 	if len(sys.argv) != 3:
@@ -1,4 +1,5 @@
 from enum import Enum, auto
+import re
 
 class LexException(Exception): pass
 
@@ -10,6 +11,7 @@ class TOKENS(Enum):
 	PARENS  = auto()
 	KEYWORD = auto()
 	NATIVE  = auto()
+	BLOCK   = auto()
 	NONE    = auto()
 	NL      = auto()
 	EOF     = auto()
@@ -37,6 +39,11 @@ __previous_token = None
 __in_macro = False
 __block_depth = 0
 
+# When set, the body of every MACRO is not lexed but returned as a single BLOCK token
+# holding its source, see skip_macro_bodies
+__skip_macro_bodies = False
+__macro_header = False  # Between a MACRO keyword and the { starting its body
+
 # The macro char is used to denote the difference between native code and
 # macro code within a macro. This can be set at the beginning of a file so the most
 # suitable (producing least conflict) character can be chosen.
@@ -69,6 +76,55 @@ def peek_next(lexer):
 		__previous_token = next(lexer)
 	return __previous_token
 
+# Characters that matter when skipping over a macro body, compiled on first use
+__block_chars = None
+
+# Reads the rest of a block whose { was just consumed, up to and including the matching }.
+# Only comments, strings and native lines need care, as braces inside them do not count.
+def __read_block(file):
+	global __block_chars
+	if (__block_chars == None): __block_chars = re.compile(r'[#"{}]|' + re.escape(MACRO_CHAR))
+
+	source = ""
+	depth = 1
+	in_string = False
+	while (True):
+		start = file.tell()
+		line = file.readline()
+		if (line == ""): raise LexException("Block is never closed")
+
+		idx = 0
+		while (idx < len(line)):
+			if (in_string):
+				idx = line.find('"', idx)
+				if (idx == -1): break
+				in_string = False
+				idx += 1
+				continue
+
+			match = __block_chars.search(line, idx)
+			if (match == None): break
+
+			char, idx = match.group(), match.end()
+			if (char == '#' or char == MACRO_CHAR): break
+			elif (char == '"'): in_string = True
+			elif (char == '{'): depth += 1
+			else:
+				depth -= 1
+				if (depth == 0):
+					# Give back everything after the closing brace
+					file.seek(start)
+					return source + file.read(idx)
+
+		source += line
+
+# Lazily parsed macros only need the source of their bodies, which is much cheaper
+# to find than lexing it. Returns the previous setting so callers can restore it
+def skip_macro_bodies(enabled):
+	global __skip_macro_bodies
+	previous, __skip_macro_bodies = __skip_macro_bodies, enabled
+	return previous
+
 def in_ops(s, ops):
 	return list(filter(lambda op: s in op, ops))
 
@@ -80,7 +136,7 @@ def in_ops(s, ops):
 #	4. IDENT - identifiers that may represent variable names
 # EOF token is given to signify the end of the stream.
 def lex(file, in_macro = None):
-	global __in_macro, __block_depth
+	global __in_macro, __block_depth, __macro_header
 
 	# Little work around for parsing StringIO sort of things
 	if (in_macro != None): __in_macro = True
@@ -95,6 +151,7 @@ def lex(file, in_macro = None):
 			macro_check = char + file.read(4)
 			if (macro_check == "MACRO"):
 				__in_macro = True
+				__macro_header = True
 				yield (TOKENS.KEYWORD, macro_check)
 				continue
 
@@ -135,8 +192,14 @@ def lex(file, in_macro = None):
 		if (char == MACRO_CHAR):
 			yield (TOKENS.NATIVE, file.readline())
 
+		elif (char == '{' and __macro_header and __skip_macro_bodies):
+			__macro_header = False
+			yield (TOKENS.BLOCK, __read_block(file))
+			__in_macro = __block_depth > 0
+
 		elif (char in PARENS):
 			if (char == '{'): 
+				__macro_header = False
 				__block_depth += 1
 			elif (char == '}'): 
 				__block_depth -= 1
@@ -170,6 +233,7 @@ def lex(file, in_macro = None):
 			# Move back one character to account for the ending condition of while loop
 			if (char != ''): file.seek(file.tell() - 1, 0)  
 
+			if (ident == "MACRO"): __macro_header = True
 			if (ident in KEYWORDS): yield (TOKENS.KEYWORD, ident)
 			elif (ident == "none"): yield(TOKENS.NONE, None)
 			else: yield (TOKENS.IDENT, ident)
@@ -181,8 +245,11 @@ def lex(file, in_macro = None):
 
 # Need to reset the lexer state properly
 def new_lex(file, in_macro = None):
-	global __previous_token
+	global __previous_token, __in_macro, __block_depth, __macro_header
 	__previous_token = None
+	__in_macro = False
+	__block_depth = 0
+	__macro_header = False
 	return lex(file, in_macro = in_macro)
 
 def lex_file(file_name):
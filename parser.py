@@ -1,6 +1,7 @@
 from lexer import *
 from sexpr import *
-import pprint
+from functools import lru_cache
+from io import StringIO
 
 # Generic exception used for any sort of parsing errors we might encounter
 class ParseException(Exception): pass
@@ -98,6 +99,9 @@ def __parse_open_paren(lexer):
 	check_next(lexer, (TOKENS.PARENS, ')'))
 	return lhs
 
+# When set, the lexer hands over macro bodies as source, parsed on first call by parse_macro_body
+__lazy_macros = False
+
 def __parse_macro(lexer):
 	application = parse_expression(lexer, -1)
 	
@@ -114,6 +118,12 @@ def __parse_macro(lexer):
 				args.append(Fparam(ident, True))
 				encountered_vari = True
 
+	if (__lazy_macros):
+		token = get_next(lexer)
+		if (token[0] != TOKENS.BLOCK):
+			raise ParseException(f"Expected: macro body, but got: {token}")
+		return SMacro(name, args, None, token[1])
+
 	body = __parse_block(lexer)
 
 	return SMacro(name, args, body)
@@ -187,13 +197,40 @@ def parse_expression(lexer, min_prec, nxt=None):
 
 	return lhs
 
-def parse(lexer):
+# With lazy_macros, syntax errors inside a macro body are only reported when it is first called
+def parse(lexer, lazy_macros = False):
+	global __lazy_macros
+	__lazy_macros = lazy_macros
+	skip_macro_bodies(lazy_macros)
+
 	statements = []
 	while (peek_next(lexer) != (TOKENS.EOF, None)):
 		statements.append(__parse_statement(lexer))
 
 	return statements
 
+# Parses the body of a lazily parsed macro once and keeps it on the definition,
+# so closures made from it later share it. Macros defined inside it stay lazy.
+def parse_macro_body(macro):
+	global __lazy_macros
+	if (macro.body == None):
+		lexer = new_lex(StringIO("{" + macro.source), in_macro = True)
+		# Restore the flags afterwards so they do not leak into whatever parses next
+		lazy_macros, __lazy_macros = __lazy_macros, True
+		skipping = skip_macro_bodies(True)
+		try:
+			macro.body = __parse_block(lexer)
+		finally:
+			__lazy_macros = lazy_macros
+			skip_macro_bodies(skipping)
+	return macro.body
+
+# Native lines repeat the same calls over and over (every loop iteration, every expansion),
+# the resulting expressions are never mutated so they can be shared
+@lru_cache(maxsize = 4096)
+def parse_native_expression(code):
+	return parse_expression(new_lex(StringIO(code), in_macro = True), -1)
+
 # Nice declarative grammar definition :)
 register_terminal(TOKENS.NUM, SNum)
 register_terminal(TOKENS.IDENT, SIdent)
@@ -252,6 +289,7 @@ def __test_fake_lex():
 
 # Small test for parsing, very coolio
 if (__name__ == "__main__"):
+	import pprint
 	statements = parse(lex_file("interpreter_with_macros.py"))    #parse(lex_file("examples/basic.pre"))
 	for statement in statements:
 		pprint.pprint(statement)
\ No newline at end of file
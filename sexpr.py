@@ -3,59 +3,62 @@ from dataclasses import dataclass
 # Represents a (potentially sugared) expression
 # These are formed during the parsing of the token stream
 # using PRATT parsing
+# Nodes are only ever matched on, never compared, so no __eq__ is generated
+# for them, which keeps creating the classes at import cheaper
 class SExpr: pass
 
-@dataclass
+@dataclass(eq = False)
 class SOp(SExpr):
 	op: str
 	exprs: list[SExpr]
 
-@dataclass
+@dataclass(eq = False)
 class SNative(SExpr):
 	code: str
 
-@dataclass
+@dataclass(eq = False)
 class SIf(SExpr):	
 	con: SExpr
 	thn: list[SExpr]
 	els: list[SExpr]
 
-@dataclass
+@dataclass(eq = False)
 class SNum(SExpr):
 	num: float
 
-@dataclass
+@dataclass(eq = False)
 class SList(SExpr):
 	elems: list[SExpr]
 
-@dataclass
+@dataclass(eq = False)
 class SStr(SExpr):
 	string: str
 
-@dataclass
+@dataclass(eq = False)
 class SIdent(SExpr):
 	ident: str
 
-@dataclass 
+@dataclass(eq = False)
 class SLoop(SExpr):
 	cond: SExpr
 	body: list[SExpr]
 
-@dataclass
+@dataclass(eq = False)
 class Fparam:
 	name: str
 	vari: bool  # whether is var_arg
 
-@dataclass
+@dataclass(eq = False)
 class SMacro(SExpr):
 	name: str
 	params: list[Fparam]
 	body: list[SExpr]
+	source: str = None  # Unparsed body when macros are parsed lazily, body is None until then
 
-@dataclass
+@dataclass(eq = False)
 class SNone(SExpr): pass
 
-@dataclass 
+@dataclass(eq = False)
 class SApp(SExpr):
 	func: SIdent
 	args: list[SExpr]
\ No newline at end of file
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3.10
+
+from interpreter import *
+from build import file_hash, sources_hash
+import importlib.util
+import os
+import py_compile
+import sys
+
+# Turns a parsed program into the source of a Python module that produces exactly the
+# same output as interpreter.interp. Every block, loop and macro body becomes a plain
+# Python function over the same Environment and Value classes the interpreter uses,
+# so only the tree walking goes away. The generated module is written next to the
+# input (rule110.pre -> rule110.pre.py) and imported, which caches it as bytecode.
+
+# Modules whose source decides what a generated module looks like
+TRANSPILER_MODULES = ("lexer.py", "parser.py", "sexpr.py", "interpreter.py", "transpile.py")
+
+GENERATED_SUFFIX = ".py"
+
+# Left associative operators, long chains of these are turned into statements as
+# Python cannot compile arbitrarily deep nested expressions
+CHAIN_OPS = ["+", "-", "*", "/", "<", ">=", "<=", "==", "||", ";"]
+CHAIN_LIMIT = 16
+
+class Transpiler:
+	def __init__(self):
+		self.functions = []  # Sources of the functions hoisted out of expressions
+		self.count = 0
+
+		# Expression text -> function name for the first call of every native line,
+		# later calls on the same line depend on what the earlier ones produced
+		self.native_calls = {}
+
+	def __fresh(self, kind):
+		self.count += 1
+		return f"_{kind}_{self.count}"
+
+	def __hoist(self, lines):
+		self.functions.append("\n".join(lines))
+
+	def __unknown_message(self, expr):
+		return repr(f"Unknown expression: {expr}")
+
+	def __unknown(self, expr):
+		return f"fail({self.__unknown_message(expr)})"
+
+	# Returns a Python expression evaluating exprs in env, like __interp_block
+	def block(self, exprs):
+		if (len(exprs) == 0): return "VNone()"
+		if (len(exprs) == 1): return self.expression(exprs[0])
+		return f"({', '.join(self.expression(expr) for expr in exprs)})[-1]"
+
+	# Returns the statements evaluating exprs in env, with the value of the last one assigned to result
+	def statements(self, exprs, indent, result):
+		if (len(exprs) == 0): return [f"{indent}{result}VNone()"]
+
+		lines = [f"{indent}{self.expression(expr)}" for expr in exprs[:-1]]
+		lines.append(f"{indent}{result}{self.expression(exprs[-1])}")
+		return lines
+
+	# Returns a Python expression for the val of expr, literals skip building their Value
+	def value(self, expr):
+		match expr:
+			case SNum(num): return repr(num)
+			case SStr(string): return repr(string)
+		return f"{self.expression(expr)}.val"
+
+	# Returns a Python expression evaluating expr in env, like __interp
+	def expression(self, expr):
+		match expr:
+			case SNum(num): return f"VNum({num!r})"
+			case SNone(): return "VNone()"
+			case SStr(string): return f"VStr({string!r})"
+			case SIdent(ident): return f"lookup(env, {ident!r})"
+
+			case SOp(op, [a, b]) if (op in CHAIN_OPS):
+				chain = self.__chain(expr)
+				if (len(chain) > CHAIN_LIMIT): return self.__hoist_chain(chain)
+				return self.__binary(expr, self.expression(a), self.value(a))
+
+			case SOp("-", [a]): return f"VNum(-{self.value(a)})"
+			case SOp("!", [a]): return f"VNum(gamma({self.value(a)} + 1))"
+
+			case SOp("++", [SIdent(ident)]): return f"increment(env, {ident!r}, 1)"
+			case SOp("--", [SIdent(ident)]): return f"increment(env, {ident!r}, -1)"
+
+			case SOp("=", [SIdent(ident), b]):
+				return f"set_variable(env, {ident!r}, {self.expression(b)})"
+
+			case SOp(":=", [SIdent(ident), b]):
+				return f"set_variable(env, {ident!r}, {self.expression(b)}, localized = True)"
+
+
+			case SOp("[", [a, b]):
+				return f"iterable_to_iterator({self.expression(a)})[int({self.value(b)})]"
+
+			case SOp("[=", [a, b, c]):
+				return f"mutate_iterable_index({self.expression(a)}, int({self.value(b)}), {self.expression(c)})"
+
+			case SList(elems):
+				return f"VList([{', '.join(self.expression(elem) for elem in elems)}])"
+
+			case SIf(con, thn, els):
+				return f"({self.block(thn)} if {self.value(con)} else {self.block(els)})"
+
+			case SLoop(cond, body):
+				name = self.__fresh("loop")
+				lines = [f"def {name}(env):", "\tlast = VNone()", "\tenv = Environment({}, env)"]
+				lines.append(f"\twhile ({self.value(cond)} > 0):")
+				lines += self.statements(body, "\t\t", "last = ")
+				lines.append("\treturn last")
+				self.__hoist(lines)
+				return f"{name}(env)"
+
+			case SMacro(name, params, body):
+				function = self.__fresh(f"macro_{name}")
+				self.__hoist([f"def {function}(env):", *self.statements(body, "\t", "return ")])
+				return f"set_variable(env, {name!r}, VClos({params!r}, {function}, Environment({{}}, env), {name!r}))"
+
+			case SApp(SIdent(ident), args):
+				return f"call(search_environment(env, {ident!r}), {ident!r}, [{', '.join(self.expression(arg) for arg in args)}])"
+
+			case SNative(line):
+				# Same preprocessing as the interpreter, it only depends on the line itself
+				line_stripped = line.rstrip()
+				if (line_stripped == ""): return f"emit({line!r})"
+				line = line_stripped[:-1] if line_stripped[-1] == MACRO_CHAR else line
+
+				call = find_native_line_call(line)
+				if (call == None): return f"emit({line!r})"
+
+				# Errors in the call are left for the runtime to raise when the line is reached
+				beg, end = call
+				code = line[beg + 2: end]
+				try:
+					if (code not in self.native_calls):
+						native_expr = parse_native_expression(code)
+						self.native_calls[code] = (self.native_function(native_expr), type(native_expr) is SApp)
+				except ParseException:
+					pass
+
+				return f"native({line!r}, env)"
+
+		return self.__unknown(expr)
+
+	# Returns the expression applying the binary SOp expr to an already generated left
+	# operand, given both as a Value (left) and as its val (left_val)
+	def __binary(self, expr, left, left_val, message = None):
+		op, b = expr.op, expr.exprs[1]
+		match op:
+			case "+": return f"add({left}, {self.expression(b)}, {message or self.__unknown_message(expr)})"
+			case "-" | "*" | "/": return f"VNum({left_val} {op} {self.value(b)})"
+			case "||": return f"VNum(int({left_val} or {self.value(b)}))"
+			case ";": return f"({left}, {self.expression(b)})[1]"
+		return f"VNum(int({left_val} {op} {self.value(b)}))"
+
+	# Returns the nodes of a chain like ((a + b) - c) + d, outermost last
+	def __chain(self, expr):
+		chain = []
+		while (type(expr) is SOp and expr.op in CHAIN_OPS and len(expr.exprs) == 2):
+			chain.append(expr)
+			expr = expr.exprs[0]
+		return chain[::-1]
+
+	# Hoists a function evaluating a chain one operator at a time. The error message of
+	# every step would repeat all the steps before it, so they are rebuilt from the
+	# parts of the chain only when needed, see ChainMessage
+	def __hoist_chain(self, chain):
+		name = self.__fresh("chain")
+		parts = (repr(chain[0].exprs[0]), [(expr.op, repr(expr.exprs[1])) for expr in chain])
+		lines = [f"{name}_messages = [ChainMessage({parts!r}, idx) for idx in range({len(chain)})]", "",
+		         f"def {name}(env):", f"\tvalue = {self.expression(chain[0].exprs[0])}"]
+		for idx, expr in enumerate(chain):
+			message = f"{name}_messages[{idx}]"
+			lines.append(f"\tvalue = {self.__binary(expr, 'value', 'value.val', message)}")
+		lines.append("\treturn value")
+		self.__hoist(lines)
+		return f"{name}(env)"
+
+	# Hoists a function evaluating expr in env and returns its name
+	def native_function(self, expr):
+		name = self.__fresh("native")
+		self.__hoist([f"def {name}(env):", f"\treturn {self.expression(expr)}"])
+		return name
+
+	# Returns the source of a module running statements, see run
+	def module(self, statements, header = ""):
+		body = self.statements(statements, "\t", "") if statements else ["\tpass"]
+		native_calls = ", ".join(f"{code!r}: ({name}, {is_app})" for code, (name, is_app) in self.native_calls.items())
+
+		return "\n\n".join([
+			f"{header}from transpile import *",
+			*self.functions,
+			f"NATIVE_CALLS = {{{native_calls}}}",
+			"def run(output, env = None):\n"
+			"\tstart(output, NATIVE_CALLS)\n"
+			"\tif (env == None): env = Environment({}, None)\n"
+			+ "\n".join(body),
+		]) + "\n"
+
+def transpile(statements, header = ""):
+	return Transpiler().module(statements, header)
+
+# Runtime used by the generated modules, mirrors the native line handling of the interpreter
+
+__output = None
+__native_strings = []
+__native_calls = {}
+
+def start(output, native_calls):
+	global __output
+	__output = output
+	__native_strings.clear()
+	__native_calls.update(native_calls)
+
+def fail(message):
+	raise InterpException(message)
+
+def lookup(env, ident):
+	value = search_environment(env, ident)
+	if (value == None): raise InterpException(f"Identifier {ident} not bound.")
+	return value
+
+def add(a, b, message):
+	match (a, b):
+		case (VNum(va), VNum(vb)): return VNum(va + vb)
+		case (VStr(va), VStr(vb)): return VStr(va + vb)
+	raise InterpException(str(message))
+
+# Error message for step idx of a hoisted chain, built from (repr of the first operand,
+# [(operator, repr of the right operand)...]) the same way the interpreter prints it
+class ChainMessage:
+	def __init__(self, parts, idx):
+		self.parts = parts
+		self.idx = idx
+
+	def __str__(self):
+		first, steps = self.parts
+		expr = first
+		for op, right in steps[:self.idx + 1]:
+			expr = f"SOp(op={op!r}, exprs=[{expr}, {right}])"
+		return f"Unknown expression: {expr}"
+
+def increment(env, ident, step):
+	value = search_environment(env, ident)
+	value.val += step
+	return VNum(value.val)
+
+# Built-ins are shared with the interpreter, see BUILTINS
+def call(macro, name, args):
+	if (macro == None):
+		return call_builtin(name, args, lambda macro, macro_args: call(macro, macro.name, macro_args))
+
+	bind_arguments(macro, args)
+	return macro.body(macro.env)
+
+# Native lines without any calls are written (or buffered) as they are
+def emit(line):
+	if (__native_strings): __native_strings.append(line)
+	else: __output.write(line)
+
+# Returns (function, is_application) for the call expression code
+def native_call(code):
+	if (code not in __native_calls):
+		expr = parse_native_expression(code)
+		transpiler = Transpiler()
+		name = transpiler.native_function(expr)
+
+		namespace = dict(globals())
+		exec("\n\n".join(transpiler.functions), namespace)
+		__native_calls[code] = (namespace[name], type(expr) is SApp)
+
+	return __native_calls[code]
+
+def native(line, env):
+	native_line_idx = len(__native_strings)
+	__native_strings.append("")
+
+	while (call := find_native_line_call(line)):
+		beg, end = call
+		function, is_app = native_call(line[beg + 2: end])
+
+		to_output = str(function(env))
+
+		# Function is pure, so we output its result
+		if (is_app and len(__native_strings) != (native_line_idx + 1)):
+			to_output = ""
+
+		line = line[:beg] + to_output + "".join(__native_strings[native_line_idx + 1:]) + line[end + 1:]
+
+		del __native_strings[native_line_idx + 1:]
+
+	if (native_line_idx == 0):
+		__output.write(line)
+		del __native_strings[0]
+	else:
+		__native_strings[native_line_idx] = line
+
+# Caching of generated modules next to their input
+
+def generated_path(file):
+	return file + GENERATED_SUFFIX
+
+# Returns the generated module for file, only transpiling again when file or the transpiler changed
+def load(file):
+	header = f"# Generated from {os.path.basename(file)} by transpile.py, do not edit\n" \
+	         f"# lamb: {file_hash(file)} {sources_hash(TRANSPILER_MODULES)}\n"
+	path = generated_path(file)
+
+	try:
+		with open(path, "r") as f:
+			up_to_date = f.readline() + f.readline() == header
+	except FileNotFoundError:
+		up_to_date = False
+
+	if (not up_to_date):
+		with open(path, "w") as f:
+			f.write(transpile(parse(lex_file(file)), header))
+		py_compile.compile(path, doraise = True)
+
+	spec = importlib.util.spec_from_file_location(f"lamb_{os.path.basename(file).replace('.', '_')}", path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+# Same as interpreter.interp, but runs the generated module
+def transpile_interp(file, output_filepath):
+	module = load(file)
+	with open(output_filepath, "w") as f:
+		module.run(f)
+
+	return True
+
+# Runs file through both the interpreter and the generated module and returns whether
+# the outputs (and errors, if any) are identical
+def check(file):
+	results = []
+	for run in [lambda sink: Interpreter().expand_file(file, sink), lambda sink: load(file).run(sink)]:
+		sink = StringIO()
+		try:
+			run(sink)
+			error = None
+		except Exception as e:
+			error = (type(e).__name__, str(e))
+		results.append((sink.getvalue(), error))
+
+	return results[0] == results[1]
+
+if (__name__ == "__main__"):
+	if len(sys.argv) >= 3 and sys.argv[1] == "--check":
+		mismatches = [file for file in sys.argv[2:] if not check(file)]
+		for file in sys.argv[2:]:
+			print(f"{'MISMATCH' if file in mismatches else 'OK'} {file}")
+		sys.exit(1 if mismatches else 0)
+
+	if len(sys.argv) != 3:
+		print("Usage: transpile [input filepath] [output filepath]")
+		print("       transpile --check [input filepaths...]")
+		sys.exit(0)
+
+	if (transpile_interp(sys.argv[1], sys.argv[2])):
+		print(f"Interpretation was successful, wrote to {sys.argv[2]}!")